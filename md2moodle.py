@@ -33,19 +33,10 @@ import os
 import sys
 import re
 import hashlib
-import random
 import json
-import base64
-from markdown import markdown
-
-# To prettify xml
-import xml.dom.minidom
-
-
-if sys.version_info[0] == 3:
-    from urllib.request import urlopen
-else:
-    from urllib import urlopen
+import binascii
+import functools
+import threading
 
 ######################################################################
 # Section 0 - Global constants
@@ -55,6 +46,10 @@ CONFIG = {
     # Produce debugging information while parsing
     'debug' : False,
 
+    # Convert sections to XML in parallel processes? (only when there's more
+    # than one section, CPU and enough work, e.g., many questions or code images)
+    'parallel_export' : True,
+
     # Place table borders through css style?
     'table_border' : False,
     
@@ -84,93 +79,139 @@ CONFIG = {
 # REGEX PATTERNS
 
 NEW_LINE = '\n'
-HEADER_PATTERN = re.compile(r'^\s*# (.*)$')
-QUESTION_PATTERN = re.compile(r'^(\s*)\*(\s)(.*)$')
-CORRECT_ANSWER_PATTERN = re.compile(r'^(\s*)-(\s)!(.*)$')
-WRONG_ANSWER_PATTERN = re.compile(r'^(\s*)-(\s)(.*)$')
-FEEDBACK_PATTERN = re.compile(r'^(\s*)>(.*)$')
-SWITCH_PRE_TAG_PATTERN = re.compile(r'^```.*$')
-EMPTY_LINE_PATTERN = re.compile(r'^\s*$')
-IMAGE_PATTERN = re.compile(r'!\[.*\]\((.+)\)')
-MULTI_LINE_CODE_PATTERN = re.compile(r'```(.*)\n([\s\S]+?)```', re.MULTILINE)
-SINGLE_LINE_CODE_PATTERN = re.compile(r'`([^`]+)`')
-# question mark in the regex implies that it is not greedy
+
+# Question and answer contents are replaced in a single pass over the text,
+# through an alternation of named groups; the matched alternative (the
+# match 'lastgroup') selects the replacement function. Order is relevant:
+# multi-line code comes first so it consumes any inner backticks and
+# double dollar formulas come before single dollar ones (which, in
+# questions, also can't end on a $$).
+#
+# question mark in the latex regexes implies that it is not greedy
 # If you have ... $...$ ... $...$..., with the question mark, both parts will be replaced, giving ... REPL ... REPL   ...
 # Without question mark, you have one replacement from the first to the last $.
-SINGLE_DOLLAR_LATEX_PATTERN = re.compile(r'\$(.+?)\$')
-# re.DOTALL implies that meta character . also corresponds to \n
+# (?s:) implies that meta character . also corresponds to \n
 # Hence, between $$ and $$, there may have several lines
-# question mark in the regex implies that it is not greedy
-# If you have ... $$...$$ ... $$...$$..., with the question mark, both parts will be replaced, giving ... REPL ... REPL   ...
-# Without question mark, you have one replacement from the first to the last $$.
-DOUBLE_DOLLAR_LATEX_PATTERN = re.compile(r'\$\$(.+?)\$\$', re.DOTALL)
-BLOCKCODE_PATTERN = re.compile(r'^(\s*)```(.*)$')
-
-TABLE_PATTERN = re.compile(r'\[\[\[(.*)\n([\s\S]+?)\]\]\]', re.MULTILINE)
+SINGLE_LINE_CODE_REGEX = r'(?P<single_line_code>`(?P<inline_code>[^`]+)`)'
+SINGLE_DOLLAR_LATEX_REGEX = r'(?P<single_dollar_latex>\$(?P<inline_latex>.+?)\$)'
+# In questions, a single dollar formula can't close on the first $ of a
+# complete $$...$$ formula, e.g., 'costs $5. Compute $$x^2$$', so double
+# dollars keep precedence as if they were replaced first ('$x$$y$' still
+# holds two single dollar formulas)
+SINGLE_DOLLAR_LATEX_QUESTION_REGEX = r'(?P<single_dollar_latex>\$(?P<inline_latex>[^\n][^$\n]*)\$(?!\$(?s:.+?)\$\$))'
+
+QUESTION_CONTENT_PATTERN = re.compile('|'.join((
+    r'(?P<multi_line_code>```(?P<lexer>.*)\n(?P<code>[\s\S]+?)```)',
+    SINGLE_LINE_CODE_REGEX,
+    r'(?P<image>!\[.*\]\((?P<image_file>.+)\))',
+    r'(?P<double_dollar_latex>\$\$(?P<block_latex>(?s:.+?))\$\$)',
+    SINGLE_DOLLAR_LATEX_QUESTION_REGEX,
+    r'(?P<table>\[\[\[.*\n(?P<table_content>[\s\S]+?)\]\]\])',
+)))
+
+ANSWER_CONTENT_PATTERN = re.compile('|'.join((
+    SINGLE_LINE_CODE_REGEX,
+    SINGLE_DOLLAR_LATEX_REGEX,
+)))
 
 ##
-# Regex helpers
-
-def is_header(string):
-    return False if get_header(string) is None else True
-
-def is_question(string):
-    return False if get_question(string) is None else True
-
-def is_answer(string):
-    return is_correct_answer(string) or is_wrong_answer(string)
-
-def is_correct_answer(string):
-    return False if get_correct_answer(string) is None else True
-
-def is_feedback(string):
-    return False if get_answer_feedback(string) is None else True 
-
-def is_wrong_answer(string):
-    return False if get_wrong_answer(string) is None else True
+# Line classification
+#
+# Each parsed line is classified by its first non-blank character(s),
+# without any regex (see 'classify_line' for the line kinds). Only the
+# correct/wrong answer kinds share a prefix.
 
-def is_blank(string):
-    return re.match(EMPTY_LINE_PATTERN, string)
+EOF_LINE = "EOF"
 
-def is_blockcode(string):
-    return re.match(BLOCKCODE_PATTERN, string)
+# First (non-blank) characters of all line kinds, except text
+LINE_MARKERS = frozenset('#*->`')
 
-def is_eof(string):
-    return string == "EOF"
+def classify_line(string):
+    """Classifies a line by inspecting its first non-blank characters.
 
-## 
-# REGEX matching  and grouping
+    Line kinds, after any leading blanks, and their content:
 
-def get_header(string):
-    match = re.match(HEADER_PATTERN, string)
-    if match:
-        return match.group(1)
-    return None
+        blank           only blanks                 the line
+        header          '# ' caption                the caption
+        question        '*', a blank, text          the text
+        correct_answer  '-', a blank, '!', text     the text
+        wrong_answer    '-', a blank, text          the text
+        feedback        '>' text                    the text
+        blockcode       '```' lexer                 the line
+        eof             the EOF_LINE sentinel       None
 
-def get_question(string):
-    match = re.match(QUESTION_PATTERN, string)
-    if match:
-        return match.group(3)
-    return None
+    Returns a (kind, content) tuple. Lines of any other form are of kind
+    'text' and its content is the line itself.
+    """
+    stripped = string.lstrip()
+    if not stripped:
+        return 'blank', string
+
+    # most lines are question text, i.e., don't start with any marker
+    first = stripped[0]
+    if first not in LINE_MARKERS:
+        if string == EOF_LINE:
+            return 'eof', None
+        return 'text', string
+
+    if first == '#':
+        if stripped[1:2] == ' ':
+            return 'header', stripped[2:]
+    elif first == '*':
+        if stripped[1:2].isspace():
+            return 'question', stripped[2:]
+    elif first == '-':
+        if stripped[1:2].isspace():
+            if stripped[2:3] == '!':
+                return 'correct_answer', stripped[3:]
+            return 'wrong_answer', stripped[2:]
+    elif first == '>':
+        return 'feedback', stripped[1:]
+    elif first == '`':
+        if stripped.startswith('```'):
+            return 'blockcode', string
+
+    return 'text', string
 
-def get_correct_answer(string):
-    match = re.match(CORRECT_ANSWER_PATTERN, string)
-    if match:
-        return match.group(3)
-    return None
+##
+# Dependencies
+#
+# Heavier dependencies, or those only needed by some quizzes, are
+# imported once, on first use.
+
+# Markdown instances aren't thread-safe, hence one set per thread
+markdown_converters = threading.local()
+
+def markdown_converter(extensions=()):
+    """Returns a markdown.Markdown instance, one per set of extensions (and
+    thread), as building it (and its processors) is costlier than a conversion."""
+    converters = markdown_converters.__dict__
+    converter = converters.get(extensions)
+    if converter is None:
+        from markdown import Markdown
+        converter = converters[extensions] = Markdown(extensions=list(extensions))
+    return converter
+
+def markdown(text, extensions=()):
+    """Converts markdown text to html, through the markdown package."""
+    return markdown_converter(tuple(extensions)).reset().convert(text)
+
+@functools.lru_cache(maxsize=None)
+def import_urlopen():
+    """Only required for images referenced by url."""
+    from urllib.request import urlopen
+    return urlopen
 
+@functools.lru_cache(maxsize=None)
+def import_pygments():
+    """Only required to convert code snippets into images."""
 
-def get_wrong_answer(string):
-    match = re.match(WRONG_ANSWER_PATTERN, string)
-    if match:
-        return match.group(3)
-    return None
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import ImageFormatter
+    from pygments.lexers import ClassNotFound
 
-def get_answer_feedback(string):
-    match = re.match(FEEDBACK_PATTERN, string)
-    if match:
-        return match.group(2)
-    return None
+    return highlight, get_lexer_by_name, ImageFormatter, ClassNotFound
 
 ##
 # REGEX and XML/HTML text transformations
@@ -179,71 +220,145 @@ def wrap_cdata(content):
     """Wraps content inside a CDATA xml block."""
     return '<![CDATA[' + content + ']]>'
 
+# Translation table for 'sanitize_entities'. Being applied in a single pass,
+# the replacements don't interfere with each other, e.g., '&' in '&gt;'.
+ENTITIES_TABLE = str.maketrans({
+    '#': '\\#',
+    '&': '&amp;',
+    '>': '&gt;',
+    '<': '&lt;',
+    '*': '&ast;',
+})
+
 def sanitize_entities(text):
     """Converts <, >, * and & to html entities."""
+    return text.translate(ENTITIES_TABLE)
 
-    text = text.replace('#','\\#')
-    #unfortunately, this order is important
-    text = text.replace('&','&amp;')
-    text = text.replace('>','&gt;')
-    text = text.replace('<','&lt;')
-    text = text.replace('*','&ast;')    
-        
-    return text
+# Rendering is a pure function of its inputs, so identical texts (e.g., stock
+# wrong answers like "None of the above") are only rendered once per run.
+# Questions with images, tables or code snapshots aren't, as these also
+# depend on files and on CONFIG (images have their own cache, by mtime).
+RENDER_CACHE_SIZE = 2048
+UNCACHED_QUESTION_MARKERS = ('![', '[[[', '{img}')
 
 def render_answer(text):
     """Replaces any allowed contents, e.g., text, inline code and formulas
      and returns the CDATA content."""
+    return _render_answer_core(text)
 
-    text = re.sub(SINGLE_LINE_CODE_PATTERN, replace_single_line_code, text)
-    text = re.sub(SINGLE_DOLLAR_LATEX_PATTERN, replace_latex, text)
+# Answers such as '42' or 'Option A' (or short questions) hold no markdown
+# syntax at all; for those, markdown would only wrap the text in a
+# paragraph (no list, e.g., '1. ', no surrounding whitespace)
+PLAIN_TEXT_PATTERN = re.compile(r"(?!\d+\. )[A-Za-z0-9][A-Za-z0-9 ,.;:?!'()/%-]*(?<! )")
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_answer_core(text):
+    if PLAIN_TEXT_PATTERN.fullmatch(text):
+        return wrap_cdata('<p>' + text + '</p>')
+
+    text = ANSWER_CONTENT_PATTERN.sub(replace_answer_content, text)
 
     return wrap_cdata( markdown( text ) ) 
 
 # TODO: render feedback
 
 def render_question(text, md_dir_path):
-    """Replaces any allowed contents, e.g., code and images
-     and returns the CDATA content."""
+    r"""Replaces any allowed contents, e.g., code and images
+     and returns the CDATA content.
 
-    text = re.sub(MULTI_LINE_CODE_PATTERN, replace_multi_line_code, text)
-    text = re.sub(SINGLE_LINE_CODE_PATTERN, replace_single_line_code, text)
-    text = re.sub(IMAGE_PATTERN, replace_image_wrapper(md_dir_path), text)
-    text = re.sub(DOUBLE_DOLLAR_LATEX_PATTERN, replace_latex_double_dollars, text)
-    text = re.sub(SINGLE_DOLLAR_LATEX_PATTERN, replace_latex, text)
-    text = re.sub(TABLE_PATTERN, replace_table, text)
+    Double dollar formulas take precedence over a preceding lone $, e.g.,
+
+    >>> print(render_question('The ticket costs $5. Compute $$x^2$$', '.'))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    <![CDATA[<p>The ticket costs $5. Compute \[x^2\] </p>]]>
+    >>> print(render_question(r'Pay $5 or $$\frac{1}{2}$$ of it', '.'))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    <![CDATA[<p>Pay $5 or \[\frac{1}{2}\] of it</p>]]>
+    """
+    if any(marker in text for marker in UNCACHED_QUESTION_MARKERS):
+        return _render_question(text, md_dir_path)
+    return _render_question_cached(text, md_dir_path)
+
+def _render_question(text, md_dir_path):
+    # single line questions are buffered with their line break(s)
+    plain_text = text.rstrip('\n')
+    if PLAIN_TEXT_PATTERN.fullmatch(plain_text):
+        return wrap_cdata('<p>' + plain_text + '</p>')
+
+    text = QUESTION_CONTENT_PATTERN.sub(replace_question_content_wrapper(md_dir_path), text)
     text = wrap_cdata( markdown_custom(text) )
     return text
 
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_question_cached(text, md_dir_path):
+    return _render_question(text, md_dir_path)
+
 def markdown_custom(text):
     """Just calls markdown, but may be extended in the future."""
     return markdown(text)
-    
-def replace_table(match):
-    content = match.group(2)
 
-    html = markdown(content, extensions=['tables'])
+def print_render_cache_stats():
+    """Prints the hit/miss statistics of the rendering caches (of this process)."""
+    for cached in (_render_answer_core, _render_question_cached):
+        print("Cache %25s | %s" % (cached.__name__, cached.cache_info()))
+    
+def replace_answer_content(match):
+    """Dispatches an ANSWER_CONTENT_PATTERN match to its replacement."""
+    if match.lastgroup == 'single_line_code':
+        return replace_single_line_code(match)
+    else:
+        return replace_latex(match)
+
+# The replacement is the same for every question of a markdown file
+@functools.lru_cache(maxsize=None)
+def replace_question_content_wrapper(md_dir_path):
+    replace_image = replace_image_wrapper(md_dir_path)
+
+    def replace_question_content(match):
+        """Dispatches a QUESTION_CONTENT_PATTERN match to its replacement."""
+        kind = match.lastgroup
+        if kind == 'multi_line_code':
+            return replace_multi_line_code(match)
+        elif kind == 'single_line_code':
+            return replace_single_line_code(match)
+        elif kind == 'image':
+            return replace_image(match)
+        elif kind == 'double_dollar_latex':
+            return replace_latex_double_dollars(match)
+        elif kind == 'single_dollar_latex':
+            return replace_latex(match)
+        else:
+            # table cells may hold any of the other contents
+            content = QUESTION_CONTENT_PATTERN.sub(replace_question_content, match['table_content'])
+            return replace_table(content)
 
-    if not CONFIG['table_border']:
-        return html
+    return replace_question_content
 
-    # Put borders on table. This is not a content issue,
-    # but rather a presentation one. However, the rendering
-    # is nicer for a quiz environment.
-    css_style = """
+# Put borders on table. This is not a content issue,
+# but rather a presentation one. However, the rendering
+# is nicer for a quiz environment.
+TABLE_BORDER_PREFIX = """
         <style type="text/css">
             div.border_table + table, th, td {
             border: 1px solid black;
             border-collapse: collapse;
             }
-        </style>"""
+        </style>""" + r"<div class='border_table'>"
+
+def replace_table(content):
+    """Converts the (already replaced) markdown table content to html."""
+
+    html = markdown(content, extensions=['tables'])
+
+    if not CONFIG['table_border']:
+        return html
 
-    return css_style + r"<div class='border_table'>" + html + r"</div>"
+    return TABLE_BORDER_PREFIX + html + r"</div>"
 
 
 def replace_latex_double_dollars(match):
     # Take the part without the $$ at the beginning and at the end
-    code = match.group(1)
+    code = match['block_latex']
 
     # Replace \\ by \\\\ in code
     code = code.replace(r"\\", r"\\\\ ")
@@ -258,7 +373,7 @@ def replace_latex_double_dollars(match):
 
 
 def replace_latex(match):
-    code = match.group(1)
+    code = match['inline_latex']
     code = code.replace('(', r'\left(')
     code = code.replace(')', r'\right)')
     return r'\\(' + code + r'\\)'
@@ -269,15 +384,15 @@ def replace_single_line_code(match):
 
     Output should only be wrapped inside a <code> tag.
     """
-    code = match.group(1)
+    code = match['inline_code']
     code = sanitize_entities(code)
 
     return '<code>' + code + '</code>'
 
 
 def replace_multi_line_code(match):
-    lexer = match.group(1)
-    code = match.group(2)
+    lexer = match['lexer']
+    code = match['code']
 
     if not lexer:
         lexer = ''
@@ -295,39 +410,87 @@ def replace_multi_line_code(match):
 
 def replace_image_wrapper(md_dir_path):
     def replace_image(match):
-        file_name = match.group(1)
+        file_name = match['image_file']
         if (not os.path.isabs(file_name)) and ('://' not in file_name):
             file_name = os.path.join(md_dir_path, file_name)
         return build_image_tag(file_name)
     return replace_image
 
 
+# Chunk size used to stream images into base64; a multiple of 3 so no
+# padding is produced in between chunks.
+BASE64_CHUNK_SIZE = 48 * 1024
+
+def encode_base64_stream(stream):
+    """Encodes the contents of a binary stream to base64, one chunk at a time."""
+
+    parts = []
+    pending = b''
+    while True:
+        chunk = stream.read(BASE64_CHUNK_SIZE)
+        if not chunk:
+            break
+        # streams (e.g., http responses) may return short reads,
+        # so keep any bytes that don't complete a 3-byte group
+        chunk = pending + chunk
+        cut = len(chunk) - len(chunk) % 3
+        parts.append(binascii.b2a_base64(chunk[:cut], newline=False).decode('ascii'))
+        pending = chunk[cut:]
+    parts.append(binascii.b2a_base64(pending, newline=False).decode('ascii'))
+
+    return ''.join(parts)
+
 def build_image_tag(file_name):
-    extension = file_name.split('.')[-1]
+    """Produces the <img> tag with the embedded image; reused images are
+    only read and encoded once, unless the local file is modified."""
+
     try:
-        data = urlopen(file_name).read()
-    except Exception:
-        f = open(file_name, 'rb')
-        data = f.read()
-    base64_image = (base64.b64encode(data)).decode('utf-8')
+        mtime = os.stat(file_name).st_mtime
+        file_name = os.path.abspath(file_name)
+    except (OSError, ValueError):
+        # not a local file, e.g., an url; cached by its name alone
+        mtime = None
+    return _build_image_tag_cached(file_name, mtime)
+
+@functools.lru_cache(maxsize=256)
+def _build_image_tag_cached(file_name, mtime):
+    if '://' in file_name:
+        # the extension of an url comes before its query or fragment
+        path = file_name.partition('?')[0].partition('#')[0]
+        image = import_urlopen()(file_name)
+    else:
+        path = file_name
+        image = open(file_name, 'rb')
+    extension = os.path.splitext(path)[1][1:] or 'png'
+    with image:
+        base64_image = encode_base64_stream(image)
     src_part = 'data:image/' + extension + ';base64,' + base64_image
     return '<img style="display:block;" src="' + src_part + '" />'
 
-def convert_code_image_base64(lexer_name, code):
-    """Converts a code snippet to an image in base64 format."""
-    
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name
-    from pygments.formatters import ImageFormatter
-    from pygments.lexers import ClassNotFound
-    import tempfile
+@functools.lru_cache(maxsize=32)
+def get_code_lexer(lexer_name):
+    """Returns the pygments lexer for this name, defaulting to pascal.
+
+    Lexers are reused across snippets of the same language. Note that the
+    same doesn't apply to ImageFormatter, which keeps the drawn text of
+    previous snippets.
+    """
+
+    _, get_lexer_by_name, _, ClassNotFound = import_pygments()
 
     if not lexer_name:
         lexer_name = 'pascal'
     try:
-        lexer = get_lexer_by_name(lexer_name)
+        return get_lexer_by_name(lexer_name)
     except ClassNotFound:
-        lexer = get_lexer_by_name('pascal')
+        return get_lexer_by_name('pascal')
+
+def convert_code_image_base64(lexer_name, code):
+    """Converts a code snippet to an image in base64 format."""
+    
+    highlight, _, ImageFormatter, _ = import_pygments()
+
+    lexer = get_code_lexer(lexer_name)
 
     imgBytes = highlight(code, lexer,\
                         ImageFormatter(font_size=CONFIG['pygments.font_size'],\
@@ -343,15 +506,10 @@ def convert_code_image_base64(lexer_name, code):
         img_id += 1
         CONFIG['pygments.dump_image_id'] = img_id
 
-    temp = tempfile.NamedTemporaryFile()
-    temp.write(imgBytes)
-    temp.seek(0)
-
     extension = 'png'
-    base64_image = (base64.b64encode(temp.read())).decode('utf-8')
+    base64_image = binascii.b2a_base64(imgBytes, newline=False).decode('ascii')
     src_part = 'data:image/' + extension + ';base64,' + base64_image
     
-    temp.close()
     return '<img style="display:block;" src="' + src_part + '" />'
 
 
@@ -371,16 +529,17 @@ class Quiz(dict):
 
         self.is_valid = False
 
-    def consume_header(self, line):
+    def consume_header(self, header):
         """Starts a new section with this header."""
 
         self.section = []
-        self[get_header(line)] = self.section
+        self[header] = self.section
 
-    def consume_question(self, line):
+    def consume_question(self, text):
         """Starts a new question with this content."""
 
-        self.current_question = {'text': get_question(line), 'answers': []}
+        # text is buffered as a list of lines while parsing; see __complete
+        self.current_question = {'text': [text], 'answers': [], 'correct_count': 0}
         self.section.append(self.current_question)
 
     def append_to_question(self, line): 
@@ -389,45 +548,28 @@ class Quiz(dict):
         #TODO: there's a problem enforcing line breaks in the output?
         # Maybe we should instead inform the user of the correct markdown
         # sintax, i.e., place two spaces to enforce a line break.
-        self.current_question['text'] += line + '\n'
+        self.current_question['text'].extend((line, '\n'))
 
-    def consume_answer(self, line):
-        """Appends the answer from this content to the current question."""
+    def consume_answer(self, text, correct):
+        """Appends the answer with this content to the current question."""
 
-        if is_correct_answer(line):
-
-            current_answer = {
-                'text': get_correct_answer(line),
-                'correct': True,
-                'feedback': None
-                }
-            
-            self.current_question['answers'].append(current_answer)
-
-        elif is_wrong_answer(line):
-
-            current_answer = {
-                'text': get_wrong_answer(line),
-                'correct': False,
-                'feedback': None
-                }
-            
-            self.current_question['answers'].append(current_answer)
+        current_answer = {
+            'text': text,
+            'correct': correct,
+            'feedback': None
+            }
 
-        else:
-            #some other content, ignore.
-            pass
+        self.current_question['answers'].append(current_answer)
+        if correct:
+            self.current_question['correct_count'] += 1
 
-    def consume_feedback(self, line):
+    def consume_feedback(self, feedback):
         cur_answer = self.current_question['answers'][-1]
-        cur_answer['feedback'] = get_answer_feedback(line)
+        cur_answer['feedback'] = feedback
 
 
     def current_question_has_correct_answers(self):
-        correct_answers = [x for x in self.current_question['answers'] if x['correct']]
-        correct_answer_count = len(correct_answers)
-        
-        return (correct_answer_count >= 1)
+        return self.current_question['correct_count'] >= 1
 
     def validate(self):
         """Must call after successful parse of document."""
@@ -435,43 +577,45 @@ class Quiz(dict):
         self.is_valid = True        
 
     def __complete(self):
-        """Completes parsed information with 'fraction' values for answers."""
+        """Completes parsed information with 'fraction' values for answers
+        and joins the buffered question text."""
+
+        penalty_weight = CONFIG['single_answer_penalty_weight'] * -1
 
         for key in self:
             section = self[key]
             for question in section:
-                correct_answers = [x for x in question['answers'] if x['correct']]
-                correct_answer_count = len(correct_answers)
+                question['text'] = ''.join(question['text'])
+                correct_answer_count = question['correct_count']
                 
                 if correct_answer_count < 1:
                     self.is_valid = False
                     raise QuizError("No correct answer(s) for %s" % (question['text']))
 
+                # both weights (and their XML fractions) are computed once per question
                 question['single'] = correct_answer_count == 1
                 weight = round(100.0 / correct_answer_count, 7)
+                wrong_weight = penalty_weight if question['single'] else 0
+                fraction, wrong_fraction = str(weight), str(wrong_weight)
                 for answer in question['answers']:
                     if answer['correct']:
-                        answer['weight'] = weight
+                        answer['weight'], answer['fraction'] = weight, fraction
                     else:
-                        if question['single']:
-                            answer['weight'] = CONFIG['single_answer_penalty_weight'] * -1
-                        else:
-                            answer['weight'] = 0
+                        answer['weight'], answer['fraction'] = wrong_weight, wrong_fraction
 
     def export_xml_to_file(self, md_file_name):
         """Produces the XML file outputs; one for each specified category in the md file."""
         if self.is_valid:            
             md_dir_path = os.path.dirname(os.path.abspath(md_file_name))
 
-            for section_caption in self:
-                section = self[section_caption]
-                xml_file = open(create_output_filename(md_file_name, section_caption), 'w')
-                # xml_file.write(section_to_xml(section, md_dir_path))
-                # Prettify xml
-                tmp = xml.dom.minidom.parseString(section_to_xml(section_caption, section, md_dir_path))
-                xml_file.write(tmp.toprettyxml())
-
-                # xml_file.write(section_to_xml(section_caption, section, md_dir_path))
+            captions = list(self)
+            sections = [self[caption] for caption in captions]
+            map_sections(section_to_xml_file,
+                         [create_output_filename(md_file_name, caption) for caption in captions],
+                         captions,
+                         sections,
+                         [md_dir_path] * len(captions),
+                         workers=export_workers(sections))
 
         else:
             print("Quiz is not marked as valid for export.")
@@ -480,31 +624,50 @@ class Quiz(dict):
         """Produces the XML output and returns the resulting text."""
         if self.is_valid:
             md_dir_path = os.getcwd()
-            result = {}            
-            for section_caption in self:
-                section = self[section_caption]
-                result[section_caption] = section_to_xml(section_caption, section, md_dir_path)
+            captions = list(self)
+            sections = [self[caption] for caption in captions]
+            xmls = map_sections(section_to_xml,
+                                captions,
+                                sections,
+                                [md_dir_path] * len(captions),
+                                workers=export_workers(sections))
+            result = dict(zip(captions, xmls))
+
             return json.dumps(result, indent=2)
         else:
             print("Quiz is not marked as valid for export.")
             return ""
         
         
+# Translation table for section captions used in output filenames
+OUTPUT_FILENAME_TABLE = str.maketrans({'/': '-', ' ': None})
+
 def create_output_filename(md_file_name, section_caption):
     """Generates and sanitizes .xml output filename.
 
-    - All extensions and spaces are removed;
+    - The markdown file extension and all spaces are removed;
     - Forward slashes '/' (possible in section caption for sub-categories)
         are replaced with hyphens.
     """
 
-    section_caption = section_caption.replace('/','-').replace(' ','')
-    md_name = md_file_name.replace('.md','')
+    section_caption = section_caption.translate(OUTPUT_FILENAME_TABLE)
+    md_name = os.path.splitext(md_file_name)[0]
 
     output_file_name = md_name + '_' + section_caption + '.xml'
 
     return output_file_name
 
+# Output files are written one line at a time, hence the larger buffer
+XML_FILE_BUFFER_SIZE = 1 << 20
+
+# Translation table to escape xml text (as minidom used to do)
+XML_TEXT_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+})
+
 def section_to_xml(section_caption, section, md_dir_path):
     """Convert a parsed section to XML
 
@@ -514,23 +677,157 @@ def section_to_xml(section_caption, section, md_dir_path):
     md_dir_path -- path of the markdown file
     """
 
-    xml = '<?xml version="1.0" ?><quiz>'
+    return ''.join(section_to_xml_chunks(section_caption, section, md_dir_path))
+
+def section_to_xml_chunks(section_caption, section, md_dir_path):
+    """Convert a parsed section to XML, yielding it one question at a time.
+
+    Same arguments as 'section_to_xml'.
+    """
+
+    yield '<?xml version="1.0" ?><quiz>'
     
     #create dummy question to specify category for questions
-    xml += '<question type="category"><category><text>' + section_caption + '</text></category></question>'
+    caption = section_caption.translate(XML_TEXT_TABLE)
+    yield f'<question type="category"><category><text>{caption}</text></category></question>'
     
-    #add parsed questions
+    #add parsed questions; a random nonce, drawn once per section,
+    #keeps their names distinct between exports
+    nonce = os.urandom(8)
     for index, question in enumerate(section):
-        xml += question_to_xml(question, index, md_dir_path)
-    xml += '</quiz>'
-    return xml
+        yield question_to_xml(question, index, md_dir_path, nonce)
+    yield '</quiz>'
+
+def section_to_xml_file(xml_file_name, section_caption, section, md_dir_path):
+    """Writes the prettified XML of a parsed section to a file, as it's generated."""
+
+    with open(xml_file_name, 'w', buffering=XML_FILE_BUFFER_SIZE) as xml_file:
+        xml_file.writelines(prettify_xml(section_to_xml_chunks(section_caption, section, md_dir_path)))
+
+def set_config(config):
+    """Replaces the CONFIG settings, e.g., in a worker process."""
+    CONFIG.update(config)
+
+# Starting the worker processes (each importing markdown) costs about as
+# much as rendering a few hundred plain questions, so a process pool is only
+# used for larger quizzes; code snapshots ({img}) are far costlier to render
+# than other questions, hence their weight.
+PARALLEL_EXPORT_MIN_WORK = 500
+CODE_IMAGE_WORK = 100
+
+def export_workers(sections):
+    """Returns the number of processes to export the sections with (1 means
+    sequentially), according to CONFIG, the CPUs and the amount of work.
+
+    Code images being dumped to disk are always exported sequentially, as
+    their ids are a shared counter.
+    """
+    if (not CONFIG['parallel_export'] or CONFIG['pygments.dump_image']
+            or len(sections) < 2):
+        return 1
 
+    work = sum(CODE_IMAGE_WORK if '{img}' in question['text'] else 1
+               for section in sections for question in section)
+    if work < PARALLEL_EXPORT_MIN_WORK:
+        return 1
 
-def question_to_xml(question, index, md_dir_path):
+    return min(len(sections), os.cpu_count() or 1)
+
+def map_sections(function, *iterables, workers=1):
+    """Maps function over the iterables, holding one item per section.
+
+    Sections are independent, so with more than one worker (see
+    'export_workers') they are processed in parallel processes. Workers get
+    a snapshot of CONFIG, as they may re-import this module (e.g., the
+    'spawn' start method).
+    """
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_config,
+                                 initargs=(dict(CONFIG),)) as executor:
+            results = list(executor.map(function, *iterables))
+
+        if CONFIG['debug']:
+            # the caches were filled in the worker processes, not in this one
+            print("Render cache statistics are not available for parallel exports")
+    else:
+        results = list(map(function, *iterables))
+
+        if CONFIG['debug']:
+            print_render_cache_stats()
+
+    return results
+
+
+XML_TOKEN_PATTERN = re.compile(r'<!\[CDATA\[.*?\]\]>|<[^>]*>|[^<]+', re.DOTALL)
+EMPTY_CDATA = '<![CDATA[]]>'
+
+def prettify_xml(fragments, indent='\t'):
+    """Indents the XML produced by 'section_to_xml_chunks', one element per line.
+
+    Follows the layout of minidom's toprettyxml, i.e., elements holding
+    only text (or CDATA) are kept in a single line, but without parsing
+    and re-serializing the whole document. Lines are yielded as soon as
+    they're complete, so fragments must not split a tag or text.
+    """
+
+    yield '<?xml version="1.0" ?>\n'
+
+    depth = 0
+    # start tag (and its text), held until we know if it has child elements
+    pending_tag = None
+    pending_text = None
+
+    for fragment in fragments:
+        for token in XML_TOKEN_PATTERN.findall(fragment):
+            if token == EMPTY_CDATA:
+                # holds no text, e.g., an empty answer, so like minidom
+                # the element is written as an empty one
+                continue
+            is_text = not token.startswith('<') or token.startswith('<![CDATA[')
+
+            if is_text and pending_tag is not None and pending_text is None:
+                pending_text = token
+                continue
+
+            if token.startswith('</') and pending_tag is not None:
+                if pending_text is None:
+                    # empty element
+                    yield indent * depth + pending_tag[:-1] + '/>\n'
+                else:
+                    # element holding only text
+                    yield indent * depth + pending_tag + pending_text + token + '\n'
+                pending_tag = pending_text = None
+                continue
+
+            # the pending element (if any) holds other elements
+            if pending_tag is not None:
+                yield indent * depth + pending_tag + '\n'
+                depth += 1
+                if pending_text is not None:
+                    # mixed content
+                    yield indent * depth + pending_text + '\n'
+                pending_tag = pending_text = None
+
+            if token.startswith('<?'):
+                # the declaration is already in place
+                pass
+            elif token.startswith('</'):
+                depth -= 1
+                yield indent * depth + token + '\n'
+            elif is_text or token.endswith('/>'):
+                yield indent * depth + token + '\n'
+            else:
+                pending_tag = token
+
+
+def question_to_xml(question, index, md_dir_path, nonce):
     """
     Converts a parsed question to XML.
 
-    <name> is automatically generated from a hash (question text + rand)
+    <name> is automatically generated from a hash (question text + nonce)
     <single> is derived from correct answers (1/0)
     <questiontext> is encoded in CDATA and html format
     """
@@ -539,28 +836,24 @@ def question_to_xml(question, index, md_dir_path):
     rendered_question_text = render_question(question['text'], md_dir_path)
 
     index_part = str(index + 1).rjust(4, '0')
-    q_part = (question['text'] + str(random.random())).encode('utf-8')
+    q_part = question['text'].encode('utf-8') + nonce
     question_single_status = ('true' if question['single'] else 'false')
     
-    xml = '<question type="multichoice">'
+    parts = ['<question type="multichoice">']
     # question name
-    xml += '<name><text>'
-    xml += index_part + hashlib.md5(q_part).hexdigest()
-    xml += '</text></name>'
+    parts.append(f'<name><text>{index_part}{hashlib.blake2b(q_part, digest_size=16).hexdigest()}</text></name>')
     # question text
-    xml += '<questiontext format="html"><text>'
-    xml += rendered_question_text
-    xml += '</text></questiontext>'
+    parts.append(f'<questiontext format="html"><text>{rendered_question_text}</text></questiontext>')
     # answer
     for answer in question['answers']:
-        xml += answer_to_xml(answer)
+        parts.append(answer_to_xml(answer))
     
     # other properties
-    xml += '<shuffleanswers>' + CONFIG['shuffle_answers'] + '</shuffleanswers>'
-    xml += '<single>' + question_single_status + '</single>'
-    xml += '<answernumbering>' + CONFIG['answer_numbering'] + '</answernumbering>'
-    xml += '</question>'
-    return xml
+    parts.append(f'<shuffleanswers>{CONFIG["shuffle_answers"]}</shuffleanswers>'
+                 f'<single>{question_single_status}</single>'
+                 f'<answernumbering>{CONFIG["answer_numbering"]}</answernumbering>'
+                 '</question>')
+    return ''.join(parts)
 
 
 def answer_to_xml(answer):
@@ -571,17 +864,16 @@ def answer_to_xml(answer):
     #make any necessary transformatins to answer
     text = render_answer(text)
 
-    xml = '<answer fraction="'+str(answer['weight'])+'">'
-    xml += '<text>'+text+'</text>'
+    parts = [f'<answer fraction="{answer["fraction"]}"><text>{text}</text>']
     
     if answer['feedback']:
         # we allow formulas and tex in the feedback, so
         # use the existing answer rendering function
         feedback = render_answer( answer['feedback'] )
-        xml += '<feedback><text>'+feedback+'</text></feedback>'
+        parts.append(f'<feedback><text>{feedback}</text></feedback>')
 
-    xml += '</answer>'
-    return xml
+    parts.append('</answer>')
+    return ''.join(parts)
 
 
 ######################################################################
@@ -605,40 +897,52 @@ class StateMachine:
     """
     def __init__(self):
         self.handlers = {}
+        self.transitions = {}
         self.state = None
+        self.handler = None
         self.endStates = []
 
     def add_state(self, name, handler, end_state=0):
         """Adds a state (name) and its handler function."""
 
-        name = name.upper()
-        self.handlers[name] = handler
+        state = name.upper()
+        self.handlers[state] = handler
+        # resolves a returned state name, as given or normalized, to its
+        # (state, handler) without normalizing it on every transition
+        self.transitions[name] = self.transitions[state] = (state, handler)
         if end_state:
-            self.endStates.append(name)
+            self.endStates.append(state)
 
     def set_start(self, name):
         """Sets the start state (name).
         The state must have been previously added through 'add_state' method. 
         """
         self.state = name.upper()
+        self.handler = self.handlers.get(self.state)
 
     def run(self, quest, line_text, line_number):
         """Executes the handler for the current state."""
 
-        try:
-            handler = self.handlers[self.state]
-        except:
+        handler = self.handler
+        if handler is None:
             raise InitializationError("must call .set_start() before .run()")
         if not self.endStates:
             raise  InitializationError("at least one state must be an end_state")
     
-        if CONFIG['debug']:
+        # the debug output is only formatted when it's enabled
+        debug = CONFIG['debug']
+        if debug:
             print("In state %25s | Processing: %s" %(self.state, line_text))
         
         newState = handler(quest, line_text, line_number)
-        self.state = newState.upper()
+        try:
+            self.state, self.handler = self.transitions[newState]
+        except KeyError:
+            # state names are case insensitive
+            self.state = newState.upper()
+            self.handler = self.handlers.get(self.state)
 
-        if self.state in self.endStates and CONFIG['debug']:
+        if debug and self.state in self.endStates:
             print("Success! Reached an end state:", newState)
 
 
@@ -653,62 +957,101 @@ class StateMachine:
 # Each handler receives the current quiz, the currently parsed line
 # line number. Line numbers aren't currently used within each state,
 # but may be useful in the future for some reason.
+#
+# Most states are described by their TRANSITIONS entry, mapping the kind
+# of the parsed line (see 'classify_line') to the action to perform, i.e.,
+# a function receiving the quiz and the line content, and the next state.
+# Transitions marked as 'guarded' are only allowed once the current question
+# has a correct answer. Any other kind of line is an error.
+
+def finish_quiz(quiz, content):
+    # mark as valid and go to end state
+    quiz.validate()
+
+consume_correct_answer = functools.partial(Quiz.consume_answer, correct=True)
+consume_wrong_answer = functools.partial(Quiz.consume_answer, correct=False)
+
+TRANSITIONS = {
+    # state: ({line kind: (action, guarded, next state)}, error)
+    "start": ({
+        'blank': (None, False, "start"),
+        'header': (Quiz.consume_header, False, "parse_header"),
+        'question': (Quiz.consume_question, False, "parse_question"),
+    }, "Expecting a header or a question"),
+
+    "parse_header": ({
+        'blank': (None, False, "parse_header"),
+        'question': (Quiz.consume_question, False, "parse_question"),
+    }, "Expecting a question"),
+
+    "parse_question": ({
+        'blank': (None, False, "parse_question"),
+        'blockcode': (Quiz.append_to_question, False, "parse_question_codeblock"),
+        'correct_answer': (consume_correct_answer, False, "parse_answer"),
+        'wrong_answer': (consume_wrong_answer, False, "parse_answer"),
+        'text': (Quiz.append_to_question, False, "parse_question"),
+    }, "Expecting text, codeblock or answer"),
+
+    "parse_answer": ({
+        'blank': (None, False, "parse_answer"),
+        'correct_answer': (consume_correct_answer, False, "parse_answer"),
+        'wrong_answer': (consume_wrong_answer, False, "parse_answer"),
+        'feedback': (Quiz.consume_feedback, False, "parse_feedback"),
+        'question': (Quiz.consume_question, True, "parse_question"),
+        'header': (Quiz.consume_header, True, "parse_header"),
+        'eof': (finish_quiz, True, "end"),
+    }, "Expecting answer, question or header"),
+
+    "parse_feedback": ({
+        'blank': (None, False, "parse_feedback"),
+        'correct_answer': (consume_correct_answer, False, "parse_answer"),
+        'wrong_answer': (consume_wrong_answer, False, "parse_answer"),
+        'question': (Quiz.consume_question, True, "parse_question"),
+        'header': (Quiz.consume_header, True, "parse_header"),
+        'eof': (finish_quiz, True, "end"),
+    }, "Expecting answer, question or header"),
+}
 
-def state_start(quiz, line_text, line_number):
-    
-    if is_blank(line_text):
-        state = "start"
-    elif is_header(line_text):
-        quiz.consume_header(line_text)
-        state = "parse_header"
-    elif is_question(line_text):
-        quiz.consume_question(line_text)
-        state = "parse_question"
-    else:
-        raise TransitionError("Expecting a header or a question")
+def transition_handler(state):
+    """Builds the handler of a state from its TRANSITIONS entry."""
 
-    return state
+    transitions, error = TRANSITIONS[state]
+    # blank lines, the most common ones, are skipped in every state
+    blank_state = transitions['blank'][2]
 
-def state_parse_header(quiz, line_text, line_number):
-    
-    if is_blank(line_text):
-        # do nothing
-        state = "parse_header"
-    elif is_question(line_text):
-        quiz.consume_question(line_text)
-        state = "parse_question"
-    else:
-        raise TransitionError("Expecting a question")
+    def handler(quiz, line_text, line_number):
+        if not line_text or line_text.isspace():
+            return blank_state
 
-    return state
+        kind, content = classify_line(line_text)
 
-def state_parse_question(quiz, line_text, line_number):
+        try:
+            action, guarded, state = transitions[kind]
+        except KeyError:
+            raise TransitionError(error) from None
 
-    if is_blank(line_text):
-        # do nothing
-        state = "parse_question"
-    elif is_blockcode(line_text):
-        quiz.append_to_question(line_text)
-        state = "parse_question_codeblock"
-    elif is_answer(line_text):
-        quiz.consume_answer(line_text)
-        state = "parse_answer"
-    elif is_header(line_text) or is_question(line_text) \
-                or is_feedback(line_text) or is_eof(line_text):
-        raise TransitionError("Expecting text, codeblock or answer")
-    else:
-        quiz.append_to_question(line_text)
-        state  = "parse_question"
-        pass
+        if guarded and not quiz.current_question_has_correct_answers():
+            raise TransitionError("Expecting at least one correct answer in previous question")
+        if action:
+            action(quiz, content)
 
-    return state
+        return state
+
+    return handler
+
+state_start = transition_handler("start")
+state_parse_header = transition_handler("parse_header")
+state_parse_question = transition_handler("parse_question")
+state_parse_answer = transition_handler("parse_answer")
+state_feedback = transition_handler("parse_feedback")
 
 def state_parse_question_codeblock(quiz, line_text, line_number):
 
-    # In a codeblock we accept everything until it closes
-    if is_eof(line_text):
+    # In a codeblock we accept everything until it closes, hence
+    # there's no need to fully classify the line
+    if line_text == EOF_LINE:
         raise TransitionError("Expecting closing codeblock")
-    elif is_blockcode(line_text):
+    elif line_text.lstrip().startswith('```'):
         quiz.append_to_question(line_text)
         state = "parse_question"
     else:
@@ -717,72 +1060,6 @@ def state_parse_question_codeblock(quiz, line_text, line_number):
 
     return state
 
-def state_parse_answer(quiz, line_text, line_number):
-
-    if is_blank(line_text):
-        # do nothing
-        state = "parse_answer"
-    elif is_answer(line_text):
-        quiz.consume_answer(line_text)
-        state = "parse_answer"
-    elif is_feedback(line_text):
-        quiz.consume_feedback(line_text)
-        state = "parse_feedback"
-    elif is_question(line_text):
-        if quiz.current_question_has_correct_answers():
-            quiz.consume_question(line_text)
-            state = "parse_question"
-        else:
-            raise TransitionError("Expecting at least one correct answer in previous question")
-    elif is_header(line_text):
-        if quiz.current_question_has_correct_answers():
-            quiz.consume_header(line_text)
-            state = "parse_header"
-        else:
-            raise TransitionError("Expecting at least one correct answer in previous question")
-    elif is_eof(line_text):
-        if quiz.current_question_has_correct_answers():
-            # mark as valid and go to end state
-            quiz.validate()
-            state = "end"
-        else:
-            raise TransitionError("Expecting at least one correct answer in previous question")
-    else:
-        raise TransitionError("Expecting answer, question or header")
-
-    return state
-
-def state_feedback(quiz, line_text, line_number):
-    if is_blank(line_text):
-        # do nothing
-        state = "parse_feedback"    
-    elif is_answer(line_text):
-        quiz.consume_answer(line_text)
-        state = "parse_answer"
-    elif is_question(line_text):
-        if quiz.current_question_has_correct_answers():
-            quiz.consume_question(line_text)
-            state = "parse_question"
-        else:
-            raise TransitionError("Expecting at least one correct answer in previous question")
-    elif is_header(line_text):
-        if quiz.current_question_has_correct_answers():
-            quiz.consume_header(line_text)
-            state = "parse_header"
-        else:
-            raise TransitionError("Expecting at least one correct answer in previous question")
-    elif is_eof(line_text):
-        if quiz.current_question_has_correct_answers():
-            # mark as valid and go to end state
-            quiz.validate()
-            state = "end"
-        else:
-            raise TransitionError("Expecting at least one correct answer in previous question")
-    else:
-        raise TransitionError("Expecting answer, question or header")
-
-    return state
-
 def state_end(quiz, line_text, line_number):
     """End state."""
     pass
@@ -790,66 +1067,117 @@ def state_end(quiz, line_text, line_number):
 ##
 # The Parser loop
 
-def parse_file(md_script):
-    """
-    Parses the markdown file one line at a time and returns a Quiz
+# The markdown file is read in large chunks, while parsed line by line
+MD_FILE_BUFFER_SIZE = 1 << 20
 
-    :param md_script: list of file lines
-	:type md_script: list
+class QuizParser:
+    """
+    Parses a markdown quiz incrementally, one line at a time, keeping the
+    state machine and line count between calls. This allows the markdown
+    to be streamed, e.g., from a file, without holding all its contents.
     """
+    def __init__(self):
+        # Create Quiz
+        self.quiz = Quiz()
+        self.line_number = 1
+
+        # Initialize state machine
+        m = StateMachine()
+        
+        m.add_state("start", state_start)
+        m.add_state("parse_header", state_parse_header)
+        m.add_state("parse_question", state_parse_question)
+        m.add_state("parse_answer", state_parse_answer)
+        m.add_state("parse_feedback", state_feedback)
+        m.add_state("parse_question_codeblock", state_parse_question_codeblock)
+        m.add_state("end", state_end, end_state=1)
+
+        m.set_start("start")
+        self.machine = m
+
+    def feed(self, line_text):
+        """Parses the next line, with or without its line ending.
+        Raises TransitionError if it is not valid in the current state;
+        'line_number' is then the number of the offending line.
+        """
 
-    # Create Quiz
-    quiz = Quiz()
+        self.__check_open()
+        self.machine.run(self.quiz, line_text.rstrip('\r\n'), self.line_number)
+        self.line_number += 1
 
-    # Initialize state machine
-    m = StateMachine()
-    
-    m.add_state("start", state_start)
-    m.add_state("parse_header", state_parse_header)
-    m.add_state("parse_question", state_parse_question)
-    m.add_state("parse_answer", state_parse_answer)
-    m.add_state("parse_feedback", state_feedback)
-    m.add_state("parse_question_codeblock", state_parse_question_codeblock)
-    m.add_state("end", state_end, end_state=1)
+    def close(self):
+        """Signals the end of the markdown and returns the parsed Quiz.
+        Raises TransitionError if the markdown can't end in the current
+        state, e.g., within a code block.
+        """
 
-    m.set_start("start")
+        self.__check_open()
+        self.machine.run(self.quiz, EOF_LINE, self.line_number)
+        return self.quiz
 
-    # Parse file lines
-    md_lines = md_script.split(NEW_LINE)
-    md_lines.append("EOF")
-    line_number = 1
+    def __check_open(self):
+        """Raises TransitionError once the end state was reached, i.e., after close()."""
+
+        if self.machine.state in self.machine.endStates:
+            raise TransitionError("Parser is already closed")
+
+def parse_lines(md_lines):
+    """
+    Parses the markdown lines one at a time and returns a Quiz
+
+    :param md_lines: lines, with or without their line endings, e.g.,
+        an opened file
+	:type md_lines: iterable
+    """
+
+    parser = QuizParser()
     try:
         for md_row in md_lines:
-            md_row = md_row.rstrip('\r')
-            md_row = md_row.rstrip('\n')
-            
-            m.run(quiz, md_row, line_number)
-
-            line_number += 1
+            parser.feed(md_row)
+        quiz = parser.close()
         
     except TransitionError as e:
-        print("Error at line %d: %s." % (line_number, e))
+        print("Error at line %d: %s." % (parser.line_number, e))
         quiz = None
 
     return quiz
 
+def parse_file(md_script):
+    """
+    Parses the markdown file one line at a time and returns a Quiz
+
+    :param md_script: markdown file contents
+	:type md_script: str
+    """
+
+    md_lines = md_script.split(NEW_LINE)
+    # as when iterating a file, a final line break doesn't start a new line
+    if not md_lines[-1]:
+        md_lines.pop()
+
+    return parse_lines(md_lines)
+
 ######################################################################
 # Section 5 - Main
 ######################################################################
 
 if __name__ == '__main__':
-    # very basic argument usage
-    if len(sys.argv) > 3:
+    # very basic argument usage; the standard input ('-') has no file name
+    # to derive the XML file names from, hence it requires stdout
+    if len(sys.argv) > 3 or (sys.argv[1:] == ['-']):
         print("Usage details: python md2moodle.py <md_file> [stdout]")
+        print("               python md2moodle.py - stdout")
         sys.exit()
 
     try:
         md_file_name = sys.argv[1]
 
-        md_file = open(md_file_name, 'r')
-        md_script = md_file.read()
-
-        quiz = parse_file(md_script)
+        # parse the file as it's read ('-' reads from the standard input)
+        if md_file_name == '-':
+            quiz = parse_lines(sys.stdin)
+        else:
+            with open(md_file_name, 'r', buffering=MD_FILE_BUFFER_SIZE) as md_file:
+                quiz = parse_lines(md_file)
 
         if quiz:
             if len(sys.argv) > 2: